@@ -16,32 +16,113 @@ Environment Variables:
 - SERVER_ADDRESS: Payment address (IATP wallet contract)
 - MCP_OPERATOR_PRIVATE_KEY: Operator signing key
 - D402_TESTING_MODE: Skip facilitator (default: true)
+- NEWSAPI_RPS: Max upstream NewsAPI requests per second (default: 5)
+- ALLOWED_ORIGINS: Comma-separated CORS allowlist (default: unset, any origin)
+- D402_AUDIT_LOG_PATH: Paid-response audit log (default: logs/d402_audit.jsonl;
+  needs persistent storage in production)
 """
 
 import os
 import logging
+import logging.handlers
+import queue
 import sys
-from typing import Dict, Any, Optional
+import asyncio
+import contextlib
+import functools
+import hashlib
+import time
+from dataclasses import dataclass
+from typing import Annotated, AsyncIterator, Dict, Any, Mapping, Optional, Tuple
 from datetime import datetime
-
-import requests
-from retry import retry
+from types import MappingProxyType
+
+import httpx
+import msgspec
+import orjson
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 from dotenv import load_dotenv
 import uvicorn
 
 load_dotenv()
 
-# Configure logging
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Server configuration, read once from the environment at import."""
+
+    stage: str
+    port: int
+    log_level: str
+    server_address: str
+    api_key: Optional[str]
+    facilitator_url: Optional[str]
+    facilitator_api_key: Optional[str]
+    operator_key: Optional[str]
+    network: str
+    testing_mode: bool
+    newsapi_rps: int
+    allowed_origins: Tuple[str, ...]
+    audit_log_path: str
+
+    def __post_init__(self) -> None:
+        if self.newsapi_rps <= 0:
+            raise ValueError("NEWSAPI_RPS must be a positive integer")
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        server_address = os.getenv("SERVER_ADDRESS")
+        if not server_address:
+            raise ValueError("SERVER_ADDRESS required for payment protocol")
+
+        return cls(
+            stage=os.getenv("STAGE", "MAINNET").upper(),
+            port=int(os.getenv("PORT", "8000")),
+            log_level=os.getenv("LOG_LEVEL", "INFO").upper(),
+            server_address=server_address,
+            api_key=os.getenv("TEST_NEWSAPI_MCP_API_KEY"),
+            facilitator_url=os.getenv("FACILITATOR_URL") or os.getenv("D402_FACILITATOR_URL"),
+            facilitator_api_key=os.getenv("D402_FACILITATOR_API_KEY"),
+            operator_key=os.getenv("MCP_OPERATOR_PRIVATE_KEY"),
+            network=os.getenv("NETWORK", "sepolia"),
+            testing_mode=os.getenv("D402_TESTING_MODE", "false").lower() == "true",
+            newsapi_rps=int(os.getenv("NEWSAPI_RPS", "5")),
+            # Comma-separated CORS allowlist; unset means any origin
+            allowed_origins=tuple(
+                origin.strip() for origin in os.getenv("ALLOWED_ORIGINS", "").split(",") if origin.strip()
+            ) or ("*",),
+            audit_log_path=os.getenv("D402_AUDIT_LOG_PATH", "logs/d402_audit.jsonl"),
+        )
+
+
+CFG = Config.from_env()
+
+# Configure logging (skip per-record thread/process lookups we never format)
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    level=CFG.log_level,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger('test-newsapi-mcp_mcp')
 
 # FastMCP from official SDK
 from mcp.server.fastmcp import FastMCP, Context
+from pydantic import Field
+from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import JSONResponse
+from starlette.routing import Route
 from starlette.middleware.cors import CORSMiddleware
 
 # D402 payment protocol - using Starlette middleware
@@ -51,27 +132,197 @@ from traia_iatp.d402.payment_introspection import extract_payment_configs_from_m
 from traia_iatp.d402.types import TokenAmount, TokenAsset, EIP712Domain
 
 # Configuration
-STAGE = os.getenv("STAGE", "MAINNET").upper()
-PORT = int(os.getenv("PORT", "8000"))
-SERVER_ADDRESS = os.getenv("SERVER_ADDRESS")
-if not SERVER_ADDRESS:
-    raise ValueError("SERVER_ADDRESS required for payment protocol")
-
-API_KEY = os.getenv("TEST_NEWSAPI_MCP_API_KEY")
-if not API_KEY:
+if not CFG.api_key:
     logger.warning(f"⚠️  TEST_NEWSAPI_MCP_API_KEY not set - payment required for all requests")
 
-logger.info("="*80)
-logger.info(f"test-newsapi-mcp MCP Server (FastMCP + D402 Wrapper)")
-logger.info(f"API: https://newsapi.org/v2")
-logger.info(f"Payment: {SERVER_ADDRESS}")
-logger.info(f"API Key: {'✅' if API_KEY else '❌ Payment required'}")
-logger.info("="*80)
+if logger.isEnabledFor(logging.INFO):
+    logger.info("="*80)
+    logger.info("test-newsapi-mcp MCP Server (FastMCP + D402 Wrapper)")
+    logger.info("API: https://newsapi.org/v2")
+    logger.info(f"Payment: {CFG.server_address}")
+    logger.info(f"API Key: {'✅' if CFG.api_key else '❌ Payment required'}")
+    logger.info("="*80)
+
+def _new_http_client() -> httpx.AsyncClient:
+    """
+    Build the shared async HTTP client for upstream NewsAPI calls.
+
+    One pooled HTTP/2 connection set to newsapi.org: TLS sessions are reused and
+    concurrent calls multiplex instead of each paying a fresh handshake.
+    Pool limits and HTTP/2 live on the transport (the client ignores them once
+    a transport is given); retries=2 covers connect failures only.
+    """
+    return httpx.AsyncClient(
+        base_url="https://newsapi.org/v2",
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        # NewsAPI's documented auth header; the server's own key is the default
+        headers={
+            "Accept-Encoding": "gzip, br",
+            "User-Agent": "test-newsapi-mcp/1.0",
+            **({"X-Api-Key": CFG.api_key} if CFG.api_key else {}),
+        },
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60),
+        ),
+    )
+
+
+# Closed when the app's lifespan ends; a later lifespan (reload, tests) rebuilds it
+_HTTP = _new_http_client()
+
+# Token bucket in front of NewsAPI. ToolCallPrecheckMiddleware checks it
+# before payment and _fetch_everything before acquiring, so a burst beyond the
+# rate is rejected immediately instead of queueing (or cascading upstream 429s)
+_LIMITER = AsyncLimiter(max_rate=CFG.newsapi_rps, time_period=1)
+
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[int]:
+    """Parse the Retry-After header (delta-seconds form) if present."""
+    try:
+        return int(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Upstream statuses worth retrying; 4xx (400/401/...) are never retried
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+# Longest Retry-After a 429 is waited out for before giving up (seconds)
+RATE_LIMIT_MAX_WAIT = 5
+
+
+def _last_outcome(state: RetryCallState) -> httpx.Response:
+    """Out of attempts: hand back the last response (or raise the last error)."""
+    assert state.outcome is not None
+    return state.outcome.result()
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential_jitter(multiplier=0.2, max=2.0),
+    retry=(
+        retry_if_exception_type(httpx.TransportError)
+        | retry_if_result(lambda r: r.status_code in RETRYABLE_STATUSES)
+    ),
+    retry_error_callback=_last_outcome,
+)
+async def _get_everything(params: Dict[str, Any], headers: Optional[Dict[str, str]]) -> httpx.Response:
+    """GET /everything with jittered backoff on transport errors and 502/503/504."""
+    async with _LIMITER:
+        response = await _HTTP.get("/everything", params=params, headers=headers)
+
+    # A short Retry-After on 429 is waited out once, outside the retry budget
+    retry_after = _retry_after_seconds(response) if response.status_code == 429 else None
+    if retry_after is not None and retry_after <= RATE_LIMIT_MAX_WAIT:
+        await asyncio.sleep(retry_after)
+        async with _LIMITER:
+            response = await _HTTP.get("/everything", params=params, headers=headers)
+    return response
+
+
+# In-process cache of successful NewsAPI responses, keyed by a hash of the query
+RESPONSE_CACHE_MAXSIZE = 1024
+RESPONSE_CACHE_TTL = 60  # seconds
+_RESPONSE_CACHE: TTLCache = TTLCache(maxsize=RESPONSE_CACHE_MAXSIZE, ttl=RESPONSE_CACHE_TTL)
+_CACHE_LOCK = asyncio.Lock()
+_CACHE_STATS = {"hits": 0, "misses": 0, "coalesced": 0}
+
+# Upstream fetches currently in flight, keyed like the cache (single-flight)
+_INFLIGHT: Dict[bytes, "asyncio.Task[Dict[str, Any]]"] = {}
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Return response cache size, hit/miss counters and in-flight fetches."""
+    return {
+        "size": len(_RESPONSE_CACHE),
+        "inflight": len(_INFLIGHT),
+        "maxsize": RESPONSE_CACHE_MAXSIZE,
+        "ttl": RESPONSE_CACHE_TTL,
+        **_CACHE_STATS,
+    }
+
+
+async def _fetch_everything(
+    key: bytes,
+    params: Dict[str, Any],
+    headers: Optional[Dict[str, str]]
+) -> Dict[str, Any]:
+    """Fetch /everything once for every caller sharing `key`, caching successes."""
+    try:
+        if not _LIMITER.has_capacity():
+            # Tokens spent since the pre-payment check; fail fast rather than
+            # queue for one. No upstream call is made
+            return {"error": "rate_limited", "retry_after": 1, "endpoint": "/everything"}
+
+        # Non-blocking request on the shared client keeps the event loop free
+        response = await _get_everything(params, headers)
+        if response.status_code == 429:
+            # Report NewsAPI's own rate limit with its Retry-After instead of raising
+            return {
+                "error": "rate_limited",
+                "retry_after": _retry_after_seconds(response),
+                "endpoint": "/everything"
+            }
+        response.raise_for_status()
+
+        data = orjson.loads(response.content)
+        # Only cache successful responses, never errors or paywalled results
+        if response.status_code == 200 and data.get("status") == "ok":
+            async with _CACHE_LOCK:
+                _RESPONSE_CACHE[key] = data
+        return data
+    finally:
+        _INFLIGHT.pop(key, None)
+
+
+# Audit trail of paid responses (newline-delimited JSON) for dispute resolution.
+# The hot path only puts records on a queue; a QueueListener thread started by
+# the app lifespan writes each one to the file, so nothing blocks the event loop.
+audit_logger = logging.getLogger("d402.audit")
+audit_logger.setLevel(logging.INFO)
+audit_logger.propagate = False
+_AUDIT_QUEUE: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+audit_logger.addHandler(logging.handlers.QueueHandler(_AUDIT_QUEUE))
+
+
+def _start_audit_listener() -> logging.handlers.QueueListener:
+    """Open the audit file and start writing queued records on a background thread."""
+    os.makedirs(os.path.dirname(CFG.audit_log_path) or ".", exist_ok=True)
+    file_handler = logging.FileHandler(CFG.audit_log_path, delay=True)
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(_AUDIT_QUEUE, file_handler)
+    listener.start()
+    return listener
+
+
+def _audit_paid_response(context: Any, key: bytes, data: Dict[str, Any]) -> None:
+    """Record a successful response served for a verified payment (Mode 2)."""
+    if "error" in data or not audit_logger.isEnabledFor(logging.INFO):
+        return
+    try:
+        state = context.request_context.request.state
+    except (AttributeError, ValueError):
+        return
+    if not getattr(state, "payment_validated", False):
+        return  # Client used its own API key - nothing was paid
+
+    price = get_payment_config("search_everything")
+    audit_logger.info(orjson.dumps({
+        "pay_id": getattr(state, "payment_uuid", None),
+        "resource": "/everything",
+        "tx_hash": None,  # Settled asynchronously by the facilitator after the response
+        "amount": price.amount if price else None,
+        "network": price.network if price else None,
+        "ts": time.time_ns(),
+        "params_hash": key.hex()
+    }).decode())
+
 
 # Create FastMCP server
 mcp = FastMCP("test-newsapi-mcp MCP Server", host="0.0.0.0")
 
-logger.info(f"✅ FastMCP server created")
+logger.info("✅ FastMCP server created")
 
 # ============================================================================
 # TOOL IMPLEMENTATIONS
@@ -92,22 +343,28 @@ logger.info(f"✅ FastMCP server created")
 # No custom implementation needed!
 
 
+# Shared payment objects - one instance per domain/asset/price, reused by all tools
+_IATP_DOMAIN = EIP712Domain(
+    name="IATPWallet",
+    version="1"
+)
+_USDC_SEPOLIA = TokenAsset(
+    address="0x1c7D4B196Cb0C7B01d743Fbc6116a902379C7238",
+    decimals=6,
+    network="sepolia",
+    eip712=_IATP_DOMAIN
+)
+_PRICE_2000 = TokenAmount(
+    amount="2000",  # 0.002 tokens
+    asset=_USDC_SEPOLIA
+)
+
+
 # API Endpoint Tool Implementations
 
 @mcp.tool()
 @require_payment_for_tool(
-    price=TokenAmount(
-        amount="2000",  # 0.002 tokens
-        asset=TokenAsset(
-            address="0x1c7D4B196Cb0C7B01d743Fbc6116a902379C7238",
-            decimals=6,
-            network="sepolia",
-            eip712=EIP712Domain(
-                name="IATPWallet",
-                version="1"
-            )
-        )
-    ),
+    price=_PRICE_2000,
     description="Search through millions of articles. NewsAPI requi"
 
 )
@@ -123,8 +380,8 @@ async def search_everything(
     language: str = "en",
     sortBy: str = "publishedAt",
     searchIn: Optional[str] = None,
-    pageSize: int = 20,
-    page: int = 1
+    pageSize: Annotated[int, Field(ge=1, le=100)] = 20,
+    page: Annotated[int, Field(ge=1)] = 1
 ) -> Dict[str, Any]:
     """
     Search through millions of articles. NewsAPI requirement: you must provide at least one of: q, sources, or domains.
@@ -163,59 +420,404 @@ async def search_everything(
 
         Note: 'context' parameter is auto-injected by MCP framework
     """
+    # ToolCallPrecheckMiddleware rejects bad arguments before payment; these
+    # checks cover calls that reach the handler without passing through it
+    if not (q or sources or domains):
+        return {"error": "at_least_one_of_q_sources_domains_required", "endpoint": "/everything"}
+
     # Payment already verified by @require_payment_for_tool decorator
     # Get API key using helper (handles request.state fallback)
     api_key = get_active_api_key(context)
+    if not api_key:
+        # The shared client would otherwise fall back to the server's own key.
+        # D402 still settles this result, so paid mode needs TEST_NEWSAPI_MCP_API_KEY
+        return {"error": "No API key available for this request", "endpoint": "/everything"}
 
     try:
-        url = f"https://newsapi.org/v2/everything"
+        # Build the query from (name, value) pairs, skipping unset params
         params = {
-            "q": q,
-            "qInTitle": qInTitle,
-            "sources": sources,
-            "domains": domains,
-            "excludeDomains": excludeDomains,
-            "from": from_,
-            "to": to,
-            "language": language,
-            "sortBy": sortBy,
-            "searchIn": searchIn,
-            "pageSize": pageSize,
-            "page": page
+            k: v for k, v in (
+                ("q", q),
+                ("qInTitle", qInTitle),
+                ("sources", sources),
+                ("domains", domains),
+                ("excludeDomains", excludeDomains),
+                ("from", from_),
+                ("to", to),
+                ("language", language),
+                ("sortBy", sortBy),
+                ("searchIn", searchIn),
+                ("pageSize", pageSize),
+                ("page", page),
+            ) if v is not None
         }
-        params = {k: v for k, v in params.items() if v is not None}
-        headers = {}
-        if api_key:
-            headers["Authorization"] = f"Bearer {api_key}"
-
-        response = requests.get(
-            url,
-            params=params,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-
-        return response.json()
-
+        # The API key is part of the key so a client's own key never reads
+        # results fetched with another key
+        key = hashlib.blake2b(
+            orjson.dumps(["/everything", api_key, params], option=orjson.OPT_SORT_KEYS),
+            digest_size=16
+        ).digest()
+        # Only a client's own key (Mode 1) needs a per-call header
+        req_headers = {"X-Api-Key": api_key} if api_key != CFG.api_key else None
+
+        async with _CACHE_LOCK:
+            cached = _RESPONSE_CACHE.get(key)
+            if cached is not None:
+                _CACHE_STATS["hits"] += 1
+            else:
+                task = _INFLIGHT.get(key)
+                if task is None:
+                    _CACHE_STATS["misses"] += 1
+                    task = asyncio.ensure_future(_fetch_everything(key, params, req_headers))
+                    # Retrieve the outcome even if every caller was cancelled
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    _INFLIGHT[key] = task
+                else:
+                    # Identical query already in flight - share its result (single-flight)
+                    _CACHE_STATS["coalesced"] += 1
+
+        # The fetch runs as its own task, so a cancelled caller (e.g. a client
+        # disconnect) never cancels the request other callers are waiting on
+        data = cached if cached is not None else await asyncio.shield(task)
+        _audit_paid_response(context, key, data)
+        return data
+
+    # httpx error messages embed the request URL; log them, but give the
+    # client a stable code instead. Upstream failures cannot be known before
+    # payment, and D402 settles them like any other tool result.
+    except httpx.HTTPStatusError as e:
+        logger.error("NewsAPI /everything returned %s: %s", e.response.status_code, e)
+        return {"error": "upstream_http_error", "status_code": e.response.status_code, "endpoint": "/everything"}
+    except httpx.TransportError as e:
+        logger.error("NewsAPI /everything unreachable: %s", e)
+        return {"error": "upstream_unavailable", "endpoint": "/everything"}
     except Exception as e:
-        logger.error(f"Error in search_everything: {e}")
+        logger.error("Error in search_everything: %s", e)
         return {"error": str(e), "endpoint": "/everything"}
 
 
 # TODO: Add your API-specific functions here
 
+
+@functools.cache
+def get_tool_payment_configs() -> Mapping[str, Dict[str, Any]]:
+    """
+    Extract payment configs from @require_payment_for_tool decorators once.
+
+    The result is frozen so D402PaymentMiddleware can share it without copies.
+    """
+    return MappingProxyType(extract_payment_configs_from_mcp(mcp, CFG.server_address))
+
+
+class PaymentCfg(msgspec.Struct, frozen=True, gc=False):
+    """Slotted, immutable view of one tool's payment config for server-side lookups."""
+
+    amount: str
+    decimals: int
+    asset_address: str
+    network: str
+    server_address: str
+    domain_name: str
+    domain_version: str
+    description: str
+
+    @classmethod
+    def from_config(cls, config: Mapping[str, Any], decimals: int) -> "PaymentCfg":
+        domain = config["eip712_domain"]
+        return cls(
+            amount=config["price_wei"],
+            decimals=decimals,
+            asset_address=config["token_address"],
+            network=config["network"],
+            server_address=config["server_address"],
+            domain_name=domain["name"],
+            domain_version=domain["version"],
+            description=config["description"],
+        )
+
+
+def _tool_price(tool_name: str) -> TokenAmount:
+    """The TokenAmount a tool was decorated with (extracted configs drop decimals)."""
+    tool = mcp._tool_manager.get_tool(tool_name)
+    assert tool is not None
+    return tool.fn._d402_payment_config["price"]
+
+
+# Resolved at import, after all @mcp.tool() definitions are registered.
+# D402PaymentMiddleware indexes the dict form (config["price_wei"], .get(...)),
+# so it keeps that; server code uses the PaymentCfg structs.
+TOOL_PAYMENT_CONFIGS = get_tool_payment_configs()
+PAYMENT_CFGS: Mapping[str, PaymentCfg] = MappingProxyType({
+    tool_name: PaymentCfg.from_config(config, decimals=_tool_price(tool_name).asset.decimals)
+    for tool_name, config in TOOL_PAYMENT_CONFIGS.items()
+})
+
+
+def get_payment_config(tool_name: str) -> Optional[PaymentCfg]:
+    """Look up the payment config for a tool (None for free tools)."""
+    return PAYMENT_CFGS.get(tool_name)
+
 # ============================================================================
 # APPLICATION SETUP WITH STARLETTE MIDDLEWARE
 # ============================================================================
 
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def _jsonrpc_error(
+    status_code: int,
+    request_id: Any,
+    code: int,
+    message: str,
+    data: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> ORJSONResponse:
+    """Build a JSON-RPC error response answered outside FastMCP."""
+    error: Dict[str, Any] = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return ORJSONResponse(
+        status_code=status_code,
+        headers=headers,
+        content={"jsonrpc": "2.0", "id": request_id, "error": error}
+    )
+
+
+def _search_everything_argument_error(arguments: Mapping[str, Any]) -> Optional[str]:
+    """Return the error code for search_everything arguments NewsAPI would reject."""
+    if not (arguments.get("q") or arguments.get("sources") or arguments.get("domains")):
+        return "at_least_one_of_q_sources_domains_required"
+    for name, low, high in (("pageSize", 1, 100), ("page", 1, None)):
+        if name not in arguments:
+            continue
+        value = arguments[name]
+        if type(value) is not int or value < low or (high is not None and value > high):
+            return f"invalid_{name}"
+    return None
+
+
+def _precheck_tool_call(request_id: Any, name: Any, arguments: Mapping[str, Any]) -> Optional[ORJSONResponse]:
+    """Reject a tools/call that cannot be served, before it is paid for."""
+    if name != "search_everything":
+        return None
+
+    error = _search_everything_argument_error(arguments)
+    if error is not None:
+        return _jsonrpc_error(400, request_id, -32602, error, {"endpoint": "/everything"})
+
+    if not _LIMITER.has_capacity():
+        return _jsonrpc_error(
+            429,
+            request_id,
+            -32000,
+            "rate_limited",
+            {"retry_after": 1, "endpoint": "/everything"},
+            headers={"Retry-After": "1"}
+        )
+    return None
+
+
+class NoStoreMiddleware:
+    """Mark MCP responses as non-cacheable so shared proxies never replay paid results."""
+
+    def __init__(self, app, path_prefix: str):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_no_store(message):
+            if message["type"] == "http.response.start":
+                # Replace, not append: the SSE response sets its own Cache-Control
+                message["headers"] = [
+                    *(
+                        (name, value) for name, value in message.get("headers", [])
+                        if name.lower() not in (b"cache-control", b"pragma")
+                    ),
+                    (b"cache-control", b"no-store, private"),
+                    (b"pragma", b"no-cache"),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_no_store)
+
+
+class RejectBatchMiddleware:
+    """
+    Reject JSON-RPC batch (array) bodies on the MCP endpoint with HTTP 400.
+
+    The MCP 2025-06-18 spec removed batching. Only the first non-whitespace
+    body byte is inspected, before payment checks or tool dispatch; the
+    consumed body chunks are replayed to the app unchanged.
+    """
+
+    def __init__(self, app, path_prefix: str):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        buffered = []
+        first_byte = b""
+        while True:
+            message = await receive()
+            buffered.append(message)
+            if message["type"] != "http.request":
+                break
+            first_byte = message.get("body", b"").lstrip()[:1]
+            if first_byte or not message.get("more_body", False):
+                break
+
+        if first_byte == b"[":
+            response = _jsonrpc_error(400, None, -32600, "JSON-RPC batching is not supported")
+            await response(scope, receive, send)
+            return
+
+        async def replay_receive():
+            if buffered:
+                return buffered.pop(0)
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+
+class PathBypassMiddleware:
+    """
+    Wrap a middleware so that requests it has no work for skip it entirely.
+
+    `inner` is the middleware class to wrap, built with the remaining options.
+    Requests to exempt paths, and any request outside the optional
+    path_prefix/methods scope, go straight to the next app as plain ASGI
+    calls; everything else is dispatched through the wrapped middleware.
+    """
+
+    def __init__(self, app, inner, exempt_paths=(), path_prefix=None, methods=None, **options):
+        self.app = app
+        self.middleware = inner(app, **options)
+        self.exempt_paths = frozenset(exempt_paths)
+        self.path_prefix = path_prefix
+        self.methods = frozenset(methods) if methods else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (
+            scope["path"] in self.exempt_paths
+            or (self.path_prefix is not None and not scope["path"].startswith(self.path_prefix))
+            or (self.methods is not None and scope["method"] not in self.methods)
+        ):
+            await self.app(scope, receive, send)
+            return
+        await self.middleware(scope, receive, send)
+
+
+class ToolCallPrecheckMiddleware:
+    """
+    Answer MCP tools/call requests that cannot be served before payment runs.
+
+    D402PaymentMiddleware settles any 2xx response it cannot parse as an
+    error, and FastMCP streams tool results as SSE, so an error returned from
+    inside a tool is still charged. `precheck(request_id, name, arguments)`
+    sees the buffered JSON-RPC body ahead of D402; a response it returns is
+    sent as-is, otherwise the body is replayed to the app unchanged.
+    """
+
+    def __init__(self, app, path_prefix: str, precheck):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.precheck = precheck
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        buffered = []
+        chunks = []
+        while True:
+            message = await receive()
+            buffered.append(message)
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        try:
+            data = orjson.loads(b"".join(chunks))
+        except orjson.JSONDecodeError:
+            data = None  # FastMCP answers malformed bodies itself
+
+        response = None
+        if isinstance(data, dict) and data.get("method") == "tools/call":
+            params = data.get("params")
+            if isinstance(params, dict):
+                arguments = params.get("arguments")
+                response = self.precheck(
+                    data.get("id"),
+                    params.get("name"),
+                    arguments if isinstance(arguments, dict) else {}
+                )
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        async def replay_receive():
+            if buffered:
+                return buffered.pop(0)
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
+
+
+# Request headers used by MCP streamable HTTP clients and the D402 payment flow
+CORS_ALLOW_HEADERS = [
+    "authorization",
+    "content-type",
+    "x-api-key",
+    "x-payment",
+    "x-payment-signature",
+    "mcp-session-id",
+    "mcp-protocol-version",
+    "last-event-id",
+]
+CORS_EXPOSE_HEADERS = ["mcp-session-id", "x-payment-response"]
+
+# Latency-critical probes that skip CORS and D402 processing
+MIDDLEWARE_EXEMPT_PATHS = ("/health",)
+
+
+async def health_check(request: Request) -> JSONResponse:
+    """Health check endpoint for container orchestration."""
+    return ORJSONResponse(
+        content={
+            "status": "healthy",
+            "service": "test-newsapi-mcp-mcp-server",
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
+
+async def cache_stats_endpoint(request: Request) -> JSONResponse:
+    """Debug endpoint exposing response cache statistics."""
+    return ORJSONResponse(content=cache_stats())
+
+
 def create_app_with_middleware():
     """
     Create Starlette app with d402 payment middleware.
     
     Strategy:
     1. Get FastMCP's Starlette app via streamable_http_app()
-    2. Extract payment configs from @require_payment_for_tool decorators
+    2. Reuse payment configs extracted from @require_payment_for_tool decorators
     3. Add Starlette middleware with extracted configs
     4. Single source of truth - no duplication!
     """
@@ -223,100 +825,156 @@ def create_app_with_middleware():
     
     # Get FastMCP's Starlette app
     app = mcp.streamable_http_app()
-    logger.info(f"✅ Got FastMCP Starlette app")
+    logger.info("✅ Got FastMCP Starlette app")
+
+    # Run the audit writer and close the shared HTTP client around FastMCP's
+    # lifespan (session manager)
+    mcp_lifespan = app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        global _HTTP
+        if _HTTP.is_closed:
+            _HTTP = _new_http_client()
+        audit_listener = _start_audit_listener()
+        try:
+            async with mcp_lifespan(app):
+                yield
+        finally:
+            await _HTTP.aclose()
+            audit_listener.stop()  # Writes any records still queued
+
+    app.router.lifespan_context = lifespan
     
-    # Extract payment configs from decorators (single source of truth!)
-    tool_payment_configs = extract_payment_configs_from_mcp(mcp, SERVER_ADDRESS)
-    logger.info(f"📊 Extracted {len(tool_payment_configs)} payment configs from @require_payment_for_tool decorators")
+    # Payment configs extracted from decorators at import (single source of truth!)
+    tool_payment_configs = TOOL_PAYMENT_CONFIGS
+    logger.info("📊 Using %d payment configs from @require_payment_for_tool decorators", len(tool_payment_configs))
     
     # D402 Configuration
-    facilitator_url = os.getenv("FACILITATOR_URL") or os.getenv("D402_FACILITATOR_URL")
-    operator_key = os.getenv("MCP_OPERATOR_PRIVATE_KEY")
-    network = os.getenv("NETWORK", "sepolia")
-    testing_mode = os.getenv("D402_TESTING_MODE", "false").lower() == "true"
+    facilitator_url = CFG.facilitator_url
+    operator_key = CFG.operator_key
+    network = CFG.network
+    testing_mode = CFG.testing_mode
     
     # Log D402 configuration with prominent facilitator info
-    logger.info("="*60)
-    logger.info("D402 Payment Protocol Configuration:")
-    logger.info(f"  Server Address: {SERVER_ADDRESS}")
-    logger.info(f"  Network: {network}")
-    logger.info(f"  Operator Key: {'✅ Set' if operator_key else '❌ Not set'}")
-    logger.info(f"  Testing Mode: {'⚠️  ENABLED (bypasses facilitator)' if testing_mode else '✅ DISABLED (uses facilitator)'}")
-    logger.info("="*60)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("="*60)
+        logger.info("D402 Payment Protocol Configuration:")
+        logger.info(f"  Server Address: {CFG.server_address}")
+        logger.info(f"  Network: {network}")
+        logger.info(f"  Operator Key: {'✅ Set' if operator_key else '❌ Not set'}")
+        logger.info(f"  Testing Mode: {'⚠️  ENABLED (bypasses facilitator)' if testing_mode else '✅ DISABLED (uses facilitator)'}")
+        logger.info("="*60)
     
     if not facilitator_url and not testing_mode:
         logger.error("❌ FACILITATOR_URL required when testing_mode is disabled!")
         raise ValueError("Set FACILITATOR_URL or enable D402_TESTING_MODE=true")
     
     if facilitator_url:
-        logger.info(f"🌐 FACILITATOR: {facilitator_url}")
-        if "localhost" in facilitator_url or "127.0.0.1" in facilitator_url or "host.docker.internal" in facilitator_url:
-            logger.info(f"   📍 Using LOCAL facilitator for development")
-        else:
-            logger.info(f"   🌍 Using REMOTE facilitator for production")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"🌐 FACILITATOR: {facilitator_url}")
+            if "localhost" in facilitator_url or "127.0.0.1" in facilitator_url or "host.docker.internal" in facilitator_url:
+                logger.info("   📍 Using LOCAL facilitator for development")
+            else:
+                logger.info("   🌍 Using REMOTE facilitator for production")
     else:
         logger.warning("⚠️  D402 Testing Mode - Facilitator bypassed")
     logger.info("="*60)
     
+    # Responses may come from the in-process cache; keep proxies from caching too
+    app.add_middleware(NoStoreMiddleware, path_prefix=mcp.settings.streamable_http_path)
+
+    # Explicit allowlist from ALLOWED_ORIGINS, parsed once into CFG
+    allowed_origins = list(CFG.allowed_origins)
+
     # Add CORS middleware first (processes before other middleware)
     app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allow all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allow all methods
-        allow_headers=["*"],  # Allow all headers
+        PathBypassMiddleware,
+        inner=CORSMiddleware,
+        exempt_paths=MIDDLEWARE_EXEMPT_PATHS,
+        allow_origins=allowed_origins,
+        allow_credentials=False,  # Lets a "*" allowlist answer with a literal "*"
+        allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+        allow_headers=CORS_ALLOW_HEADERS,
+        expose_headers=CORS_EXPOSE_HEADERS,
     )
-    logger.info("✅ Added CORS middleware (allow all origins)")
+    logger.info("✅ Added CORS middleware (origins: %s)", ", ".join(allowed_origins))
     
     # Add D402 payment middleware with extracted configs
+    # D402PaymentMiddleware is a BaseHTTPMiddleware (extra task + body stream per
+    # request) that only acts on POST to the MCP endpoint, so scope it to those
     app.add_middleware(
-        D402PaymentMiddleware,
+        PathBypassMiddleware,
+        inner=D402PaymentMiddleware,
+        exempt_paths=MIDDLEWARE_EXEMPT_PATHS,
+        path_prefix=mcp.settings.streamable_http_path,
+        methods=("POST",),
         tool_payment_configs=tool_payment_configs,
-        server_address=SERVER_ADDRESS,
+        server_address=CFG.server_address,
         requires_auth=True,  # Extracts API keys + checks payment
-        internal_api_key=API_KEY,  # Server's internal key (for Mode 2: paid access)
+        internal_api_key=CFG.api_key,  # Server's internal key (for Mode 2: paid access)
         testing_mode=testing_mode,
         facilitator_url=facilitator_url,
-        facilitator_api_key=os.getenv("D402_FACILITATOR_API_KEY"),
+        facilitator_api_key=CFG.facilitator_api_key,
         server_name="test-newsapi-mcp-mcp-server"  # MCP server ID for tracking
     )
-    logger.info("✅ Added D402PaymentMiddleware")
-    logger.info("   - Auth extraction: Enabled")
-    logger.info("   - Dual mode: API key OR payment")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("✅ Added D402PaymentMiddleware")
+        logger.info(f"   - Scoped to: POST {mcp.settings.streamable_http_path}")
+        logger.info("   - Auth extraction: Enabled")
+        logger.info("   - Dual mode: API key OR payment")
+
+    # Added after D402 so it runs first: calls that would only return an
+    # error are answered before a payment is verified or settled
+    app.add_middleware(
+        ToolCallPrecheckMiddleware,
+        path_prefix=mcp.settings.streamable_http_path,
+        precheck=_precheck_tool_call
+    )
+    logger.info("✅ Added tools/call pre-payment checks")
+
+    # Added last so it runs first: batches are rejected before any other check
+    app.add_middleware(RejectBatchMiddleware, path_prefix=mcp.settings.streamable_http_path)
+    logger.info("✅ Added JSON-RPC batch rejection")
     
-    # Add health check endpoint (bypasses middleware)
-    @app.route("/health", methods=["GET"])
-    async def health_check(request: Request) -> JSONResponse:
-        """Health check endpoint for container orchestration."""
-        return JSONResponse(
-            content={
-                "status": "healthy",
-                "service": "test-newsapi-mcp-mcp-server",
-                "timestamp": datetime.now().isoformat()
-            }
-        )
+    # Add health check endpoint (bypasses middleware). Inserted at the front of
+    # the route list so the router matches probes on its first comparison.
+    # redirect_slashes stays on: D402 skips payment for trailing-slash URLs
+    # because they redirect to /mcp, which clients such as mcp_health_check.py rely on.
+    app.router.routes.insert(0, Route("/health", endpoint=health_check, methods=["GET"]))
     logger.info("✅ Added /health endpoint")
+
+    app.router.routes.append(Route("/cache/stats", endpoint=cache_stats_endpoint, methods=["GET"]))
+    logger.info("✅ Added /cache/stats endpoint")
     
     return app
 
 if __name__ == "__main__":
-    logger.info("="*80)
-    logger.info(f"Starting test-newsapi-mcp MCP Server")
-    logger.info("="*80)
-    logger.info("Architecture:")
-    logger.info("  1. D402PaymentMiddleware intercepts requests")
-    logger.info("     - Extracts API keys from Authorization header")
-    logger.info("     - Checks payment → HTTP 402 if no API key AND no payment")
-    logger.info("  2. FastMCP processes valid requests with tool decorators")
-    logger.info("="*80)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("="*80)
+        logger.info("Starting test-newsapi-mcp MCP Server")
+        logger.info("="*80)
+        logger.info("Architecture:")
+        logger.info("  1. D402PaymentMiddleware intercepts requests")
+        logger.info("     - Extracts API keys from Authorization header")
+        logger.info("     - Checks payment → HTTP 402 if no API key AND no payment")
+        logger.info("  2. FastMCP processes valid requests with tool decorators")
+        logger.info("="*80)
     
     # Create app with middleware
     app = create_app_with_middleware()
     
-    # Run with uvicorn
+    # Run with uvicorn on uvloop + httptools (C event loop and HTTP parser).
+    # "auto" picks uvloop where it is installed (not on Windows) and falls
+    # back to asyncio elsewhere.
     uvicorn.run(
         app,
         host="0.0.0.0",
-        port=PORT,
-        log_level=os.getenv("LOG_LEVEL", "info").lower()
+        port=CFG.port,
+        log_level=CFG.log_level.lower(),
+        loop="auto",
+        http="httptools",
+        access_log=False,  # Per-request access lines duplicate MCP-level logging
+        server_header=False,
+        date_header=False
     )
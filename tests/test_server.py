@@ -0,0 +1,233 @@
+import asyncio
+import os
+import tempfile
+
+os.environ.setdefault("SERVER_ADDRESS", "0x000000000000000000000000000000000000dEaD")
+os.environ.setdefault("D402_TESTING_MODE", "true")
+os.environ.setdefault(
+    "D402_AUDIT_LOG_PATH", os.path.join(tempfile.mkdtemp(), "d402_audit.jsonl")
+)
+
+import httpx
+import pytest
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from starlette.testclient import TestClient
+
+import server
+
+MCP_HEADERS = {"Accept": "application/json, text/event-stream"}
+
+
+class FakeNewsAPI:
+    """MockTransport handler that counts requests and answers with a fixed status."""
+
+    def __init__(self, status_code=200, headers=None, delay=0.0):
+        self.calls = 0
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.delay = delay
+
+    async def __call__(self, request):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        content = b'{"status": "ok", "totalResults": 0, "articles": []}' if self.status_code == 200 else b"{}"
+        return httpx.Response(self.status_code, headers=self.headers, content=content, request=request)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(server, "_RESPONSE_CACHE", TTLCache(maxsize=16, ttl=60))
+    monkeypatch.setattr(server, "_CACHE_LOCK", asyncio.Lock())
+    monkeypatch.setattr(server, "_CACHE_STATS", {"hits": 0, "misses": 0, "coalesced": 0})
+    monkeypatch.setattr(server, "_INFLIGHT", {})
+    monkeypatch.setattr(server, "_LIMITER", AsyncLimiter(max_rate=100, time_period=1))
+    monkeypatch.setattr(server, "get_active_api_key", lambda context: "test-key")
+
+
+def use_upstream(monkeypatch, fake):
+    client = httpx.AsyncClient(base_url="https://newsapi.org/v2", transport=httpx.MockTransport(fake))
+    monkeypatch.setattr(server, "_HTTP", client)
+
+
+def search(**kwargs):
+    return server.search_everything(None, **{"q": "bitcoin", **kwargs})
+
+
+@pytest.fixture(scope="module")
+def client():
+    # The session manager's run() can only be entered once per FastMCP
+    # instance, so one app/lifespan is shared across the module.
+    with TestClient(server.create_app_with_middleware()) as c:
+        yield c
+
+
+def tool_call(arguments):
+    return {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "tools/call",
+        "params": {"name": "search_everything", "arguments": arguments},
+    }
+
+
+def test_concurrent_identical_calls_share_one_fetch(monkeypatch):
+    fake = FakeNewsAPI(delay=0.05)
+    use_upstream(monkeypatch, fake)
+
+    async def scenario():
+        tasks = [asyncio.ensure_future(search()) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        tasks[0].cancel()  # A disconnecting caller must not abort the others
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert all(result["status"] == "ok" for result in results[1:])
+    assert fake.calls == 1
+    assert server._CACHE_STATS == {"hits": 0, "misses": 1, "coalesced": 4}
+
+
+def test_repeat_call_is_a_cache_hit(monkeypatch):
+    fake = FakeNewsAPI()
+    use_upstream(monkeypatch, fake)
+
+    async def scenario():
+        return await search(), await search()
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second
+    assert fake.calls == 1
+    assert server._CACHE_STATS["hits"] == 1
+
+
+def test_burst_over_rate_fails_fast(monkeypatch):
+    fake = FakeNewsAPI()
+    use_upstream(monkeypatch, fake)
+    monkeypatch.setattr(server, "_LIMITER", AsyncLimiter(max_rate=5, time_period=1))
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(*(search(q=f"query-{n}") for n in range(8))), timeout=0.5
+        )
+
+    results = asyncio.run(scenario())
+
+    rate_limited = [result for result in results if result.get("error") == "rate_limited"]
+    assert len(rate_limited) == 3
+    assert fake.calls == 5
+
+
+def test_upstream_429_with_long_retry_after_is_not_waited_out(monkeypatch):
+    fake = FakeNewsAPI(status_code=429, headers={"Retry-After": "3600"})
+    use_upstream(monkeypatch, fake)
+
+    result = asyncio.run(search())
+
+    assert result == {"error": "rate_limited", "retry_after": 3600, "endpoint": "/everything"}
+    assert fake.calls == 1
+
+
+def test_tool_call_rejected_before_payment_when_bucket_is_empty(client, monkeypatch):
+    fake = FakeNewsAPI()
+    use_upstream(monkeypatch, fake)
+    monkeypatch.setattr(server._LIMITER, "has_capacity", lambda amount=1: False)
+
+    response = client.post("/mcp", json=tool_call({"q": "bitcoin"}), headers=MCP_HEADERS)
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1"
+    assert response.json()["error"]["message"] == "rate_limited"
+    assert fake.calls == 0
+
+
+@pytest.mark.parametrize(
+    ("arguments", "message"),
+    [
+        ({"q": "bitcoin", "pageSize": 1000}, "invalid_pageSize"),
+        ({"q": "bitcoin", "pageSize": None}, "invalid_pageSize"),
+        ({"q": "bitcoin", "page": 0}, "invalid_page"),
+        ({"language": "en"}, "at_least_one_of_q_sources_domains_required"),
+    ],
+)
+def test_invalid_arguments_rejected_before_payment(client, monkeypatch, arguments, message):
+    fake = FakeNewsAPI()
+    use_upstream(monkeypatch, fake)
+
+    response = client.post("/mcp", json=tool_call(arguments), headers=MCP_HEADERS)
+
+    assert response.status_code == 400
+    error = response.json()["error"]
+    assert error["code"] == -32602
+    assert error["message"] == message
+    assert fake.calls == 0
+
+
+def test_health(client):
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+
+def test_batch_rejected_before_dispatch(client, monkeypatch):
+    fake = FakeNewsAPI()
+    use_upstream(monkeypatch, fake)
+
+    response = client.post("/mcp", json=[tool_call({"q": "bitcoin"})], headers=MCP_HEADERS)
+
+    assert response.status_code == 400
+    error = response.json()["error"]
+    assert error["code"] == -32600
+    assert "batching" in error["message"]
+    assert fake.calls == 0
+
+
+def test_mcp_responses_carry_a_single_no_store_header(client):
+    initialize = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "initialize",
+        "params": {
+            "protocolVersion": "2025-06-18",
+            "capabilities": {},
+            "clientInfo": {"name": "test", "version": "1.0"},
+        },
+    }
+    response = client.post("/mcp", json=initialize, headers=MCP_HEADERS)
+
+    assert response.status_code == 200
+    assert response.headers.get_list("cache-control") == ["no-store, private"]
+    assert response.headers["pragma"] == "no-cache"
+
+
+def test_upstream_429_with_short_retry_after_is_retried_once(monkeypatch):
+    fake = FakeNewsAPI(status_code=429, headers={"Retry-After": "0"})
+    use_upstream(monkeypatch, fake)
+
+    result = asyncio.run(search())
+
+    assert result["error"] == "rate_limited"
+    assert fake.calls == 2
+
+
+def test_upstream_503_is_retried_then_reported(monkeypatch):
+    fake = FakeNewsAPI(status_code=503)
+    use_upstream(monkeypatch, fake)
+
+    result = asyncio.run(search())
+
+    assert result == {"error": "upstream_http_error", "status_code": 503, "endpoint": "/everything"}
+    assert fake.calls == 3
+
+
+def test_upstream_401_is_not_retried(monkeypatch):
+    fake = FakeNewsAPI(status_code=401)
+    use_upstream(monkeypatch, fake)
+
+    result = asyncio.run(search())
+
+    assert result == {"error": "upstream_http_error", "status_code": 401, "endpoint": "/everything"}
+    assert fake.calls == 1